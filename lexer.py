@@ -18,47 +18,101 @@ NON_WORD = [
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~
 
 import re
-
-ws_regex = re.compile(f"\\s+")
+import sys
+from array import array
+from bisect import bisect_right
 
 grp_sepr = re.escape(GRP_SEPR)
 radix_pt = re.escape(RADIX_PT)
 if RADIX_PT:
-    num_regex = re.compile(f"\\d+({grp_sepr}\\d+)*({radix_pt}\\d+({grp_sepr}\\d+)*)?")
+    num = f"\\d+(?:{grp_sepr}\\d+)*(?:{radix_pt}\\d+(?:{grp_sepr}\\d+)*)?"
 else:
-    num_regex = re.compile(f"\\d+({grp_sepr}\\d+)*")
+    num = f"\\d+(?:{grp_sepr}\\d+)*"
 
 def bracket_escape(chars):
-    subs = {'\\': '\\\\', ']': '\\]'}
+    subs = {'\\': '\\\\', ']': '\\]', '-': '\\-'}
     esc = [subs.get(c, c) for c in chars]
     if esc[0] == '^': esc[0] = '\\^'
     return esc
 
+str_delim = re.escape(STR_DELIM)
+str_char  = '[^' + ''.join(bracket_escape([STR_DELIM, ESCAPE])) + ']'
+symbol    = '[' + ''.join(bracket_escape(NON_WORD)) + ']'
+
 word = '[^\\s' + ''.join(bracket_escape(NON_WORD+[COMMENT,STR_DELIM])) + ']'
 mid_word = '[' + ''.join(bracket_escape(MID_WORD)) + ']'
-end_word = '(' + '|'.join(re.escape(char)+'+' for char in END_WORD) + ')'
-
-word_regex = re.compile(f"{word}+({mid_word}{word}+)*{end_word}?")
+end_word = '(?:' + '|'.join(re.escape(char)+'+' for char in END_WORD) + ')'
+
+# A single ordered alternation; the name of the group that matched (match.lastgroup)
+#   determines the kind of lexeme. Strings containing escape sequences are deliberately
+#   not matched here and are instead handled by the scanner in TokenStream.__next__.
+# Whitespace is split into runs that contain a newline ('nl') and runs that don't ('ws').
+master_regex = re.compile('|'.join(f"(?P<{name}>{pattern})" for name, pattern in [
+    ('nl',   "[^\\S\\n]*\\n\\s*"),
+    ('ws',   "\\s+"),
+    ('cmt',  f"{re.escape(COMMENT)}[^\\n]*"),
+    ('num',  num),
+    ('str',  f"{str_delim}{str_char}*{str_delim}"),
+    ('sym',  symbol),
+    ('word', f"{word}+(?:{mid_word}{word}+)*{end_word}?"),
+]))
+
+# Most symbols are recognized by a dictionary lookup before the regex is tried. A symbol
+#   that could begin a comment has to go through the regex, which tries comments first.
+# The values are interned so that every token for a given symbol shares one string.
+symbol_values = {char: sys.intern(char) for char in NON_WORD if char != COMMENT[0]}
 
 escape_seq = {ESCAPE: ESCAPE, STR_DELIM: STR_DELIM, 'n': '\n', 'r': '\r', 'e': '\x1B'}
 
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~
 
-# The token kinds are "newline", "numeric", "string", "symbol", and "word".
+# Token kinds are small integers so that comparing them is cheap; kind_names gives the
+#   name of each kind for display.
+KIND_NEWLINE = 0
+KIND_NUMERIC = 1
+KIND_STRING  = 2
+KIND_SYMBOL  = 3
+KIND_WORD    = 4
+
+kind_names = ('newline', 'numeric', 'string', 'symbol', 'word')
+
+# Passed as the value of a numeric token to defer converting its text until the value is used.
+undecoded = object()
+
+def decode_numeric(text):
+    canonical = text.replace(GRP_SEPR, '')
+    if RADIX_PT in canonical:
+        return float(canonical)
+    return int(canonical)
+
 class Token:
+    __slots__ = ('text', 'value', 'kind', 'line', 'column')
+
+    # Distinguishes tokens from parse trees when walking a tree (see parser.ParseTree).
+    IS_TOKEN = True
+
     def __init__(self, text, value, kind, line, column):
         self.text   = text
-        self.value  = value
         self.kind   = kind
         self.line   = line
         self.column = column
+        # Leaving the slot empty routes the first access through __getattr__, so reading
+        #   the value of any other token costs no more than an ordinary attribute.
+        if value is not undecoded:
+            self.value = value
+
+    def __getattr__(self, name):
+        if name == 'value' and self.kind == KIND_NUMERIC:
+            self.value = value = decode_numeric(self.text)
+            return value
+        raise AttributeError(f"'Token' object has no attribute '{name}'")
 
     def __str__(self):
         tk = "\x1B[38;5;42mToken\x1B[39m"
         if self.value is None:
-            return f"{tk} : {self.kind} @ {self.line},{self.column}"
-        value = repr(self.value) if self.kind == 'string' else self.value
-        return f"{tk} {value} : {self.kind} @ {self.line},{self.column}"
+            return f"{tk} : {kind_names[self.kind]} @ {self.line},{self.column}"
+        value = repr(self.value) if self.kind == KIND_STRING else self.value
+        return f"{tk} {value} : {kind_names[self.kind]} @ {self.line},{self.column}"
 
     def show(self):
         print(self)
@@ -70,132 +124,184 @@ class TokenStream:
         text -- text to be tokenized
         more -- nullary function that will be called to get more text
         """
-        self.text   = text
+        self.buf    = text
+        self.pos    = 0
+        self.base   = 0     # offset of self.buf[0] from the start of the text
         self.more   = more
-        self.line   = 1
-        self.column = 1
         self.just_emitted_newline = False
-        self.log = text
-
-    def _advance(self, string):
-        newlines = string.count("\n")
-        if newlines == 0:
-            self.column = self.column + len(string)
-        else:
-            self.line = self.line + newlines
-            self.column = len(string) - string.rindex("\n")
+        self._log_parts = [text]
+        # Offsets (from the start of the text) at which each line begins
+        self.line_starts = array('q', [0])
+        self._index_lines(text, 0)
+        # The most recently located line; positions are located in increasing order, so
+        #   consecutive lexemes on the same line don't need a search.
+        self.cur_line  = 1
+        self.cur_start = 0
+        self.cur_end   = self._line_end(1)
+
+    def _index_lines(self, text, offset):
+        idx = text.find("\n")
+        while idx >= 0:
+            self.line_starts.append(offset + idx + 1)
+            idx = text.find("\n", idx + 1)
+
+    def _line_end(self, line):
+        return self.line_starts[line] if line < len(self.line_starts) else float('inf')
+
+    def _locate(self, pos):
+        """
+        Returns the line and column of a position in the buffer.
+        """
+        offset = self.base + pos
+        if offset >= self.cur_end:
+            line = bisect_right(self.line_starts, offset, self.cur_line)
+            self.cur_line  = line
+            self.cur_start = self.line_starts[line - 1]
+            self.cur_end   = self._line_end(line)
+        return self.cur_line, offset - self.cur_start + 1
+
+    @property
+    def log(self):
+        """
+        All of the text read so far, including text that has already been consumed.
+        """
+        # The chunks are joined lazily (and the result kept) to avoid repeated concatenation.
+        if len(self._log_parts) > 1:
+            self._log_parts = [''.join(self._log_parts)]
+        return self._log_parts[0]
+
+    @property
+    def line(self):
+        return self._locate(self.pos)[0]
+
+    @property
+    def column(self):
+        return self._locate(self.pos)[1]
+
+    def _refill(self):
+        # Discard the text that has already been consumed before appending more.
+        addendum = self.more()
+        self._index_lines(addendum, self.base + len(self.buf))
+        self.cur_end = self._line_end(self.cur_line)
+        self.buf = self.buf[self.pos:] + addendum
+        self.base += self.pos
+        self.pos = 0
+        self._log_parts.append(addendum)
 
     def __next__(self):
+        master_match = master_regex.match
         while True:
-            # Strip leading whitespace (or emit a newline token)
-            match = ws_regex.match(self.text)
-            if match is not None:
-                tok_line, tok_column = self.line, self.column
-
-                whitespace = match.group()
-                self._advance(whitespace)
-                self.text = self.text[match.end():]
-
-                if EMIT_NEWLINES and ("\n" in whitespace) and not self.just_emitted_newline:
-                    self.just_emitted_newline = True
-                    return Token(whitespace, None, 'newline', tok_line, tok_column)
-
             # Is the text empty?
-            if len(self.text) == 0:
+            if self.pos >= len(self.buf):
                 if self.more is None:
                     return None
-                addendum = self.more()
-                self.text += addendum
-                self.log  += addendum
+                self._refill()
                 continue
 
-            # Is this a comment?
-            if self.text.startswith(COMMENT):
-                while True:
-                    if "\n" in self.text:
-                        end_of_comment = self.text.index("\n")
-                        self._advance(self.text[:end_of_comment])
-                        self.text = self.text[end_of_comment:]
-                        break
-                    else:
-                        self._advance(self.text)
-                        self.text = ""
-                        if self.more is None:
-                            return None
-                        addendum = self.more()
-                        self.text += addendum
-                        self.log  += addendum
-                continue
+            start = self.pos
 
-            # At this point, we're guaranteed not to return a newline, so
-            #   go ahead and preemptively set just_emitted_newline to False.
-            self.just_emitted_newline = False
-            tok_line, tok_column = self.line, self.column
-
-            # Is this a number?
-            match = num_regex.match(self.text)
-            if match is not None:
-                numstr = match.group()
-                self._advance(numstr)
-                self.text = self.text[match.end():]
+            # Is this a symbol?
+            symbol = symbol_values.get(self.buf[start])
+            if symbol is not None:
+                self.just_emitted_newline = False
+                self.pos += 1
+                return Token(symbol, symbol, KIND_SYMBOL, *self._locate(start))
 
-                canonical = numstr.replace(GRP_SEPR, '')
-                if RADIX_PT in canonical:
-                    num = float(canonical)
-                else:
-                    num = int(canonical)
-                return Token(numstr, num, 'numeric', tok_line, tok_column)
+            match = master_match(self.buf, self.pos)
 
-            # Is this a string?
-            if self.text.startswith(STR_DELIM):
-                idx = 1
-                escape = False
+            if match is not None:
+                lexeme = match.group()
+                self.pos = match.end()
+                group = match.lastgroup
+
+                # Strip whitespace (or emit a newline token)
+                if group == 'nl':
+                    if EMIT_NEWLINES and not self.just_emitted_newline:
+                        self.just_emitted_newline = True
+                        return Token(lexeme, None, KIND_NEWLINE, *self._locate(start))
+                    continue
+                if group == 'ws':
+                    continue
+
+                # Skip comments (which never contain a newline)
+                if group == 'cmt':
+                    # A comment that runs to the end of what has been read so far may
+                    #   continue in the text returned by more().
+                    while self.pos >= len(self.buf) and self.more is not None:
+                        self._refill()
+                        end_of_comment = self.buf.find("\n")
+                        if end_of_comment < 0:
+                            end_of_comment = len(self.buf)
+                        self.pos = end_of_comment
+                    continue
+
+                # At this point, we're guaranteed not to return a newline.
+                self.just_emitted_newline = False
+
+                tok_line, tok_column = self._locate(start)
+
+                if group == 'str':
+                    return Token(lexeme, lexeme[1:-1], KIND_STRING, tok_line, tok_column)
+
+                if group == 'num':
+                    return Token(lexeme, undecoded, KIND_NUMERIC, tok_line, tok_column)
+
+                if group == 'sym':
+                    symbol = sys.intern(lexeme)
+                    return Token(symbol, symbol, KIND_SYMBOL, tok_line, tok_column)
+
+                # Words are interned so that repeated identifiers share one string.
+                word = sys.intern(lexeme)
+                return Token(word, word, KIND_WORD, tok_line, tok_column)
+
+            # This must be a string containing escape sequences (or spanning more than
+            #   what has been read so far).
+            tok_line, tok_column = self._locate(start)
+
+            if self.buf.startswith(STR_DELIM, self.pos):
+                self.just_emitted_newline = False
+                buf = self.buf
+                idx = self.pos + 1
                 value = []
+                # The position of the next delimiter (or the end of the buffer) is kept
+                #   across escape sequences, so that each character is only scanned once.
+                delim = -1
                 while True:
-                    if idx >= len(self.text):
+                    # Copy everything up to the next delimiter or escape in one step.
+                    if delim < idx:
+                        delim = buf.find(STR_DELIM, idx)
+                        if delim < 0:
+                            delim = len(buf)
+                    escape = buf.find(ESCAPE, idx, delim)
+                    stop = delim if escape < 0 else escape
+                    if stop > idx:
+                        value.append(buf[idx:stop])
+                        idx = stop
+
+                    # An escape sequence needs the character after the escape as well.
+                    if idx + (escape >= 0) >= len(buf):
                         if self.more is None:
                             raise Exception(f"unterminated string ({tok_line}, {tok_column})")
-                        addendum = self.more()
-                        self.text += addendum
-                        self.log  += addendum
+                        idx -= self.pos
+                        self._refill()
+                        buf = self.buf
+                        delim = -1
                         continue
-                    char = self.text[idx]
-                    if escape:
-                        replacement = escape_seq.get(char, None)
-                        if replacement is None:
-                            raise Exception(f"unknown escape sequence ({tok_line}, {tok_column})")
-                        else:
-                            value.append(replacement)
-                        escape = False
-                    elif char == ESCAPE:
-                        escape = True
-                    elif char == STR_DELIM:
+
+                    if escape < 0:
                         idx += 1
                         break
-                    else:
-                        value.append(char)
-                    idx += 1
-                verbatim = self.text[:idx]
-                self._advance(verbatim)
-                self.text = self.text[idx:]
 
-                value = ''.join(value)
-                return Token(verbatim, value, 'string', tok_line, tok_column)
+                    replacement = escape_seq.get(buf[idx+1], None)
+                    if replacement is None:
+                        raise Exception(f"unknown escape sequence ({tok_line}, {tok_column})")
+                    value.append(replacement)
+                    idx += 2
+                verbatim = self.buf[self.pos:idx]
+                self.pos = idx
 
-            # Is this a symbol?
-            if self.text[0] in NON_WORD:
-                symbol = self.text[0]
-                self._advance(symbol)
-                self.text = self.text[1:]
-                return Token(symbol, symbol, 'symbol', tok_line, tok_column)
-
-            # This must be a word.
-            match = word_regex.match(self.text)
-            if match is not None:
-                word = match.group()
-                self._advance(word)
-                self.text = self.text[match.end():]
-                return Token(word, word, 'word', tok_line, tok_column)
+                value = ''.join(value)
+                return Token(verbatim, value, KIND_STRING, tok_line, tok_column)
 
             raise Exception(f"unknown lexing error ({tok_line}, {tok_column})")
 
@@ -205,7 +311,7 @@ class TokenStream:
             tok = next(self)
             if tok is None:
                 return None if len(buf) == 0 else buf
-            if tok.kind == 'newline':
+            if tok.kind == KIND_NEWLINE:
                 return buf
             buf.append(tok)
 
@@ -220,33 +326,129 @@ class TokenBuffer:
             self.stream = TokenStream(stream, more)
         else:
             self.stream = stream
-        self.buffer = []
+        # Tokens are stored field by field in parallel arrays and are only
+        #   materialized as Token objects when indexed. Lines and columns are
+        #   unsigned 32-bit, which is half the size of a C long on most platforms.
+        #   The value of a numeric token is always stored as undecoded; each Token
+        #   materialized from it decodes the text again if asked for its value.
+        self.texts   = []
+        self.values  = []
+        self.kinds   = array('b')
+        self.lines   = array('I')
+        self.columns = array('I')
         self.is_complete = False
 
+    @classmethod
+    def from_bytes(cls, data, encoding = 'utf-8'):
+        """
+        Returns a completed buffer containing every token in data.
+
+        data     -- bytes to be decoded and tokenized
+        encoding -- encoding of data
+        """
+        buffer = cls(data.decode(encoding))
+        buffer.complete()
+        return buffer
+
+    def _append(self, tok):
+        value = undecoded if tok.kind == KIND_NUMERIC else tok.value
+        self.texts.append(tok.text)
+        self.values.append(value)
+        self.kinds.append(tok.kind)
+        self.lines.append(tok.line)
+        self.columns.append(tok.column)
+
+    def _token(self, idx):
+        return Token(self.texts[idx], self.values[idx], self.kinds[idx],
+                     self.lines[idx], self.columns[idx])
+
     def __len__(self):
         if self.is_complete:
-            return len(self.buffer)
+            return len(self.kinds)
         raise Exception("length unknown because buffer has not been completed")
 
     def __getitem__(self, idx):
         if self.is_complete:
-            return self.buffer[idx]
+            if isinstance(idx, slice):
+                return [self._token(i) for i in range(*idx.indices(len(self.kinds)))]
+            return self._token(idx)
         if idx < 0:
             raise IndexError("length unknown because buffer has not been completed")
-        if idx >= len(self.buffer):
-            for _ in range(idx - len(self.buffer) + 1):
+        if idx >= len(self.kinds):
+            for _ in range(idx - len(self.kinds) + 1):
                 tok = next(self.stream)
                 if tok is None:
                     self.is_complete = True
                     break
-                self.buffer.append(tok)
-        return self.buffer[idx]
+                self._append(tok)
+        return self._token(idx)
 
     def complete(self):
-        if self.stream.more is not None:
+        self.complete_bulk()
+
+    def complete_bulk(self):
+        """
+        Tokenizes the rest of the text by iterating over matches of the master regex and
+          appending their fields directly, rather than calling next() on the stream once per
+          token. The stream is only consulted for text the regex cannot match (strings with
+          escape sequences and lexing errors).
+        """
+        stream = self.stream
+        if stream.more is not None:
             raise Exception("cannot complete buffer")
-        while (tok := next(self.stream)) is not None:
-            self.buffer.append(tok)
+
+        buf = stream.buf
+        pos = stream.pos
+        just_emitted_newline = stream.just_emitted_newline
+        while True:
+            for match in master_regex.finditer(buf, pos):
+                start = match.start()
+                if start != pos:
+                    break
+                pos = match.end()
+                group = match.lastgroup
+
+                if group == 'nl':
+                    if not EMIT_NEWLINES or just_emitted_newline:
+                        continue
+                    just_emitted_newline = True
+                    lexeme, value, kind = match.group(), None, KIND_NEWLINE
+                elif group == 'ws' or group == 'cmt':
+                    continue
+                else:
+                    just_emitted_newline = False
+                    lexeme = match.group()
+                    if group == 'num':
+                        value, kind = undecoded, KIND_NUMERIC
+                    elif group == 'str':
+                        value, kind = lexeme[1:-1], KIND_STRING
+                    elif group == 'sym':
+                        lexeme = value = sys.intern(lexeme)
+                        kind = KIND_SYMBOL
+                    else:
+                        # Words are interned so that repeated identifiers share one string.
+                        lexeme = value = sys.intern(lexeme)
+                        kind = KIND_WORD
+
+                line, column = stream._locate(start)
+                self.texts.append(lexeme)
+                self.values.append(value)
+                self.kinds.append(kind)
+                self.lines.append(line)
+                self.columns.append(column)
+
+            if pos >= len(buf):
+                break
+
+            # The regex cannot match at pos, so let the stream handle this token.
+            stream.pos = pos
+            stream.just_emitted_newline = just_emitted_newline
+            self._append(next(stream))
+            pos = stream.pos
+            just_emitted_newline = stream.just_emitted_newline
+
+        stream.pos = pos
+        stream.just_emitted_newline = just_emitted_newline
         self.is_complete = True
 
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~
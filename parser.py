@@ -1,4 +1,6 @@
-from lexer import Token
+import sys
+
+from lexer import Token, KIND_SYMBOL
 
 # Arranged from high to low precedence. Unary operators are 'prefix' or 'postfix', and binary
 #   operators are 'left' or 'right' associative.
@@ -30,19 +32,24 @@ OPERATORS = [
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~
 
 singlechar_ops = []     # [str]
-multichar_ops  = []     # [str]
+multichar_ops  = set()  # {str}
 
 prefix_ops  = {}        # {str -> (precedence : int, name : str)}
 postfix_ops = {}        # {str -> (precedence : int, name : str)}
 binary_ops  = {}        # {str -> (precedence : int, right-assoc : bool, name : str)}
 
+# Operator symbols are interned so that dictionary lookups with symbol tokens can usually
+#   succeed on an identity comparison.
+def _intern(sym):
+    return None if sym is None else sys.intern(sym)
+
 for prec in range(len(OPERATORS)):
     level = OPERATORS[-1 - prec]
     if level[0] in ('prefix', 'postfix'):
         op_dict = (postfix_ops if level[0] == 'postfix' else prefix_ops)
         for op in level[1]:
             sym, name = op
-            op_dict[sym] = (prec, name)
+            op_dict[_intern(sym)] = (prec, name)
             if sym is None:
                 raise Exception("application must be a binary operator")
 
@@ -50,29 +57,73 @@ for prec in range(len(OPERATORS)):
         rassoc = (level[0] == 'right')
         for op in level[1]:
             sym, name = op
-            binary_ops[sym] = (prec, rassoc, name)
+            binary_ops[_intern(sym)] = (prec, rassoc, name)
     else:
         raise Exception("associativity should be 'left', 'right', 'prefix', or 'postfix'")
 
     for op in level[1]:
-        sym, _ = op
+        sym = _intern(op[0])
         if sym is None:
             continue
         if len(sym) > 1:
-            multichar_ops.append(sym)
+            multichar_ops.add(sym)
         elif len(sym) > 0:
             singlechar_ops.append(sym)
 
+# Every role of each operator symbol in one entry, so that all the ways a symbol can be used
+#   are found with a single lookup. Roles a symbol doesn't have are None.
+op_table = {}           # {str -> (prefix entry, postfix entry, binary entry)}
+
+for sym in prefix_ops.keys() | postfix_ops.keys() | binary_ops.keys():
+    op_table[sym] = (prefix_ops.get(sym), postfix_ops.get(sym), binary_ops.get(sym))
+
+no_roles = (None, None, None)
+
+# Delimiters (parentheses, brackets, and braces), combined in a single table so that
+#   classifying a symbol takes one lookup. The strings are interned, like the symbols
+#   the lexer produces, so comparing a token against a closing delimiter is an identity check.
+delimiters = {}         # {str -> (opening : bool, closing delimiter : str, region name : str)}
+
+for left, right, name in [('(', ')', 'parentheses'), ('[', ']', 'brackets'), ('{', '}', 'braces')]:
+    left, right = sys.intern(left), sys.intern(right)
+    delimiters[left]  = (True,  right, name)
+    delimiters[right] = (False, right, name)
+
+# Regions whose contents are wrapped in a ParseTree named after the region; the contents of
+#   parentheses are spliced directly into the enclosing sequence.
+wrapped_regions = frozenset(['brackets', 'braces'])
+
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~
 
+# Pieces of the tree display, built once rather than for every line
+tree_tag    = "\x1B[38;5;129mTree\x1B[39m"
+branch_mark = "\x1B[2m\u251C\u2500\x1B[22m "     # before a child that has later siblings
+last_mark   = "\x1B[2m\u2514\u2500\x1B[22m "     # before the last child
+branch_rule = "\x1B[2m\u2502\x1B[22m  "           # below a child that has later siblings
+last_rule   = "   "                                 # below the last child
+
 class ParseTree:
+    __slots__ = ('label', 'children', 'first_token', 'last_token')
+
+    # Trees appear alongside tokens in sequences; giving them a kind that matches no token
+    #   kind lets the parser test for symbols without an isinstance check.
+    kind = None
+    IS_TOKEN = False
+
     def __init__(self, label, children):
         self.label = label
         self.children = children
+        # The outermost tokens of the tree are kept so that its extent can be found
+        #   without walking it (e.g. when displaying an error).
+        if len(children) > 0:
+            first, last = children[0], children[-1]
+            self.first_token = first if first.IS_TOKEN else first.first_token
+            self.last_token  = last  if last.IS_TOKEN  else last.last_token
+        else:
+            self.first_token = self.last_token = None
 
     def __str__(self):
-        tr = "\x1B[38;5;129mTree\x1B[39m"
-        return f"{tr} {self.label}"
+        return f"{tree_tag} {self.label}"
 
     def __len__(self):
         return len(self.children)
@@ -83,36 +134,80 @@ class ParseTree:
     def __getitem__(self, x):
         return self.children[x]
 
-    def show(self, top=True):
-        lines = [str(self)]
-        num_children = len(self.children)
-        for idx, child in enumerate(self.children):
-            last = (idx + 1 == num_children)
-            mark = "\u2514" if last else "\u251C"
-            mark = f"\x1B[2m{mark}\u2500\x1B[22m "
-            if isinstance(child, Token):
-                lines.append(mark + str(child))
+    def show(self):
+        out = []
+        self.render(out)
+        sys.stdout.write(''.join(out))
+
+    def render(self, out):
+        """
+        Appends the lines displaying this tree to out.
+
+        out -- list of strings
+        """
+        out.append(f"{tree_tag} {self.label}\n")
+        # The walk keeps a stack of margins, one per enclosing subtree, each built once
+        #   from its parent's margin when the walk descends into that subtree.
+        margins = [""]
+        stack = [[self.children, 0]]    # [[children, index of next child]]
+        while len(stack) > 0:
+            frame = stack[-1]
+            children, idx = frame
+            if idx == len(children):
+                stack.pop()
+                margins.pop()
+                continue
+            frame[1] = idx + 1
+
+            child = children[idx]
+            last = (idx + 1 == len(children))
+            margin = margins[-1]
+            if child.IS_TOKEN:
+                out.append(f"{margin}{last_mark if last else branch_mark}{child}\n")
             else:
-                block = child.show(top=False)
-                lines.append(mark + block[0])
-                margin = "   " if last else "\x1B[2m\u2502\x1B[22m  "
-                for ln in block[1:]:
-                    lines.append(margin + ln)
-        if top: print("\n".join(lines))
-        return lines
+                out.append(f"{margin}{last_mark if last else branch_mark}{tree_tag} {child.label}\n")
+                margins.append(margin + (last_rule if last else branch_rule))
+                stack.append([child.children, 0])
 
 
 def extract_tokens(obj):
+    tokens = []
+    stack = [obj]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if isinstance(obj, Token):
+            tokens.append(obj)
+        elif isinstance(obj, ParseTree):
+            stack.extend(reversed(obj.children))
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(reversed(obj))
+        else:
+            raise RuntimeError(f"unable to extract tokens from {type(obj)}")
+    return tokens
+
+
+def token_span(obj):
+    """
+    Returns the first and last tokens of a token, ParseTree, or list/tuple of these.
+    """
     if isinstance(obj, Token):
-        return [obj]
+        return obj, obj
     if isinstance(obj, ParseTree):
-        return sum((extract_tokens(x) for x in obj.children), [])
-    if isinstance(obj, (list, tuple)):
-        return sum((extract_tokens(x) for x in obj), [])
-    raise RuntimeError(f"unable to extract tokens from {type(obj)}")
+        return obj.first_token, obj.last_token
+    tokens = extract_tokens(obj)
+    return tokens[0], tokens[-1]
+
 
+# Pieces of the error display
+error_tag     = "\x1B[91merror\x1B[39m"
+error_rule    = "\x1B[2m\u2502\x1B[22m "       # left margin beneath the error message
+highlight_on  = "\x1B[91m"
+highlight_off = "\x1B[39m"
+dim           = "\x1B[2m"                       # labels are left dim to the end of the line
 
 class ParseFailure:
+    __slots__ = ('message', 'labels', 'highlight')
+
     def __init__(self, msg, hi):
         """
         msg -- string describing the failure
@@ -123,7 +218,7 @@ class ParseFailure:
         self.highlight = hi
 
     def __str__(self):
-        return f"\x1B[91merror\x1B[39m: {self.message}"
+        return f"{error_tag}: {self.message}"
 
     def mark(self, label):
         self.labels.append(label)
@@ -133,105 +228,111 @@ class ParseFailure:
         log_lines -- a copy of the text prior to tokenization split into lines
         """
         if self.highlight is None:
-            print(f"\x1B[91merror\x1B[39m: {self.message}")
+            sys.stdout.write(f"{error_tag}: {self.message}\n")
             return
-        tokens = extract_tokens(self.highlight)
-        top = tokens[ 0].line - 1
-        bot = tokens[-1].line - 1
-        print(f"\x1B[91merror\x1B[39m: line {tokens[0].line}: " + self.message)
+        first, last = token_span(self.highlight)
+        top = first.line - 1
+        bot = last.line - 1
+        out = [f"{error_tag}: line {first.line}: {self.message}\n"]
         if bot-top > 1:
+            sys.stdout.write(out[0])
             return  # not sure yet how to display multi-line errors
         labels = [x for x in self.labels if x is not None][::-1]
         line = log_lines[top]
-        margin = "\x1B[2m\u2502\x1B[22m "
+        margin = error_rule
         if len(labels) > 0:
-            print(margin, end='')
-            print(f"\x1B[2min {'/'.join(labels)}")
-        print(margin)
-        left  = tokens[ 0].column - 1
-        right = tokens[-1].column - 1 + len(tokens[-1].text)
+            out.append(f"{margin}{dim}in {'/'.join(labels)}\n")
+        out.append(margin + "\n")
+        left  = first.column - 1
+        right = last.column - 1 + len(last.text)
         l, m, r = line[:left], line[left:right], line[right:]
-        print(margin + f'{l}\x1B[91m{m}\x1B[39m{r}')
-        print(margin, end='')
-        print(" "*left, end='')
-        print("\x1B[91m^", end='')
-        print("~"*(right-left-1), end='')
-        print("\x1B[39m", end='')
-        print()
+        out.append(f"{margin}{l}{highlight_on}{m}{highlight_off}{r}\n")
+        out.append(f"{margin}{' '*left}{highlight_on}^{'~'*(right-left-1)}{highlight_off}\n")
+        sys.stdout.write(''.join(out))
 
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~
 
-def _parse_operators(seq, min_precedence):
+def _reduce(operands, operators, precedence):
     """
-    Returns a token, ParseTree, ParseFailure, or None.
+    Pops every pending operator whose right-hand side cannot extend past an operator of the
+      given precedence, replacing its arguments on the operand stack with a ParseTree.
+    """
+    while len(operators) > 0 and precedence < operators[-1][0]:
+        _, arity, name = operators.pop()
+        if arity == 1:
+            operands[-1] = ParseTree(name, [operands[-1]])
+        else:
+            rhs = operands.pop()
+            operands[-1] = ParseTree(name, [operands[-1], rhs])
+
+
+def parse_operators(seq):
+    """
+    Returns a token, ParseTree, or ParseFailure.
+
+    seq -- a nonempty list of tokens and/or ParseTrees guaranteed to not include any delimiters
     """
     if len(seq) == 0:
-        return None
-
-    lhs = seq[0]
-    index = 1
-    if isinstance(lhs, Token) and lhs.kind == 'symbol':
-        if lhs.value in prefix_ops:
-            precedence, name = prefix_ops[lhs.value]
-            rhs_parse = _parse_operators(seq[index:], precedence)
-            if rhs_parse is None:
-                return ParseFailure('unary operator missing argument', lhs)
-            if isinstance(rhs_parse, ParseFailure):
-                return rhs_parse
-            rhs, num_tokens = rhs_parse
-            index += num_tokens
-            lhs = ParseTree(name, [rhs])
-
-        elif lhs.value in binary_ops:
-            return ParseFailure('binary operator missing left-hand argument', lhs)
+        raise AssertionError()
 
-    while True:
-        if index >= len(seq):
-            break
+    operands  = []      # [token or ParseTree]
+    operators = []      # [(minimum precedence of right-hand side : int, arity : int, name : str)]
 
-        op = seq[index]
-        is_symbol = isinstance(op, Token) and op.kind == 'symbol'
-        if is_symbol and op.value in postfix_ops:
-            precedence, name = postfix_ops[op.value]
-            if precedence < min_precedence:
-                break
-            lhs = ParseTree(name, [lhs])
-            index += 1
-            continue
+    application = binary_ops[None]
 
-        elif is_symbol and op.value in binary_ops:
-            precedence, rassoc, name = binary_ops[op.value]
-            if precedence < min_precedence:
-                break
-            index += 1
-            if index >= len(seq):
-                return ParseFailure('binary operator missing right-hand argument', op)
+    length = len(seq)
+    index = 0
+    while True:
+        # Expecting an operand, possibly preceded by prefix operators
+        lhs = seq[index]
+        index += 1
+        if lhs.kind == KIND_SYMBOL:
+            prefix, _, binary = op_table.get(lhs.value, no_roles)
+            if prefix is not None:
+                precedence, name = prefix
+                if index >= length:
+                    return ParseFailure('unary operator missing argument', lhs)
+                operators.append((precedence, 1, name))
+                continue
+
+            elif binary is not None:
+                return ParseFailure('binary operator missing left-hand argument', lhs)
+
+        operands.append(lhs)
+
+        # Expecting postfix operators followed by a binary operator (or application)
+        while index < length:
+            op = seq[index]
+            if op.kind == KIND_SYMBOL:
+                _, postfix, binary = op_table.get(op.value, no_roles)
+            else:
+                postfix, binary = None, None
 
-        else:
-            precedence, rassoc, name = binary_ops[None]
-            if precedence < min_precedence:
-                break
+            if postfix is not None:
+                precedence, name = postfix
+                _reduce(operands, operators, precedence)
+                operands[-1] = ParseTree(name, [operands[-1]])
+                index += 1
+                continue
 
-        rhs_parse = _parse_operators(seq[index:], precedence + (0 if rassoc else 1))
-        if rhs_parse is None:
-            raise AssertionError()
-        if isinstance(rhs_parse, ParseFailure):
-            return rhs_parse
-        rhs, num_tokens = rhs_parse
+            if binary is not None:
+                precedence, rassoc, name = binary
+                index += 1
+                if index >= length:
+                    return ParseFailure('binary operator missing right-hand argument', op)
 
-        index += num_tokens
-        lhs = ParseTree(name, [lhs, rhs])
+            else:
+                precedence, rassoc, name = application
 
-    return (lhs, index)
+            _reduce(operands, operators, precedence)
+            operators.append((precedence + (0 if rassoc else 1), 2, name))
+            break
 
+        else:
+            break
 
-def parse_operators(seq):
-    parse = _parse_operators(seq, 0)
-    if parse is None:
-        raise AssertionError()
-    if isinstance(parse, ParseFailure):
-        return parse
-    return parse[0]
+    _reduce(operands, operators, -1)
+    return operands[0]
 
 
 def parse_interior(container, seq):
@@ -243,84 +344,98 @@ def parse_interior(container, seq):
     """
     if len(seq) == 0:
         return []
-    op_parse = parse_operators(seq)
-    if isinstance(op_parse, ParseFailure):
-        return op_parse
-    if container == 'brackets' or container == 'braces':
+    op_parse = None
+    if len(seq) == 1:
+        # A lone operand (e.g. the contents of "(x)") is its own parse; only a lone symbol
+        #   that is a prefix or binary operator needs parse_operators to report the failure.
+        item = seq[0]
+        if item.kind != KIND_SYMBOL:
+            op_parse = item
+        else:
+            prefix, _, binary = op_table.get(item.value, no_roles)
+            if prefix is None and binary is None:
+                op_parse = item
+    if op_parse is None:
+        op_parse = parse_operators(seq)
+        if isinstance(op_parse, ParseFailure):
+            return op_parse
+    if container in wrapped_regions:
         return [ParseTree(container, [op_parse])]
     return [op_parse]
 
 
-def adjacent(tok1, tok2):
-    return tok2.line == tok1.line and abs(tok2.column - tok1.column) == 1
-
-
 def parse(seq):
-    # Join up multicharacter operators
+    # Join up multicharacter operators, noting along the way whether any delimiters appear
     if len(multichar_ops) > 0:
+        has_delims = False
+        joined = []
+        length = len(seq)
         index = 0
-        while index < len(seq)-1:
-            if (tok1 := seq[index]).kind == 'symbol' and (tok2 := seq[index+1]).kind == 'symbol':
-                if adjacent(tok1, tok2) and (concat := tok1.value + tok2.value) in multichar_ops:
-                    tok = Token(concat, concat, 'symbol', tok1.line, tok1.column)
-                    seq[index] = tok
-                    seq[index+1] = None
-                    index += 1
+        while index < length:
+            tok1 = seq[index]
+            if tok1.kind == KIND_SYMBOL:
+                if index + 1 < length:
+                    tok2 = seq[index+1]
+                    # Symbols are single characters, so adjacent symbols are one column apart.
+                    if tok2.kind == KIND_SYMBOL and tok2.line == tok1.line and tok2.column == tok1.column+1:
+                        if (concat := tok1.value + tok2.value) in multichar_ops:
+                            concat = sys.intern(concat)
+                            joined.append(Token(concat, concat, KIND_SYMBOL, tok1.line, tok1.column))
+                            index += 2
+                            continue
+                if tok1.value in delimiters:
+                    has_delims = True
+            joined.append(tok1)
             index += 1
 
-        seq = [tok for tok in seq if tok is not None]
+        seq = joined
+    else:
+        has_delims = any(tok.kind == KIND_SYMBOL and tok.value in delimiters for tok in seq)
 
-    # Handle delimiters (parentheses, brackets, and braces)
-    left_delims   = ('(', '[', '{')
-    right_delims  = (')', ']', '}')
-    corresponding = {'(': ')', '[': ']', '{': '}'}
-    delim_name    = {')': 'parentheses', ']': 'brackets', '}': 'braces'}
+    # Without delimiters, the whole sequence is a single region
+    if not has_delims:
+        return parse_interior('root', seq)
 
-    stack = []
-    index = 0
-    while True:
-        if index >= len(seq):
-            break
-
-        token = seq[index]
-        if token.kind != 'symbol' or token.value not in (left_delims+right_delims):
-            index += 1
+    # Handle delimiters (parentheses, brackets, and braces)
+    # Each open delimiter saves the output list of its enclosing region; tokens are appended
+    #   to the innermost region, which is parsed and spliced into its parent when closed.
+    stack = []          # [(left delimiter token, expected right delimiter, enclosing output)]
+    out = []
+    for token in seq:
+        info = delimiters.get(token.value) if token.kind == KIND_SYMBOL else None
+        if info is None:
+            out.append(token)
             continue
 
-        if token.value in left_delims:
-            stack.append((index, corresponding[token.value]))
-            index += 1
+        opening, right, name = info
+        if opening:
+            stack.append((token, right, out))
+            out = []
             continue
 
         if len(stack) == 0:
             return ParseFailure('unpaired delimiter', token)
 
-        left_index, expected_delim = stack[-1]
+        left_token, expected_delim, enclosing = stack[-1]
         if token.value != expected_delim:
             return ParseFailure('mismatched or unpaired delimiter', token)
 
-        interior = seq[left_index+1:index]
-        inter_length = len(interior)
-
-        replacement = parse_interior(delim_name[token.value], interior)
+        replacement = parse_interior(name, out)
         if isinstance(replacement, ParseFailure):
             return replacement
         if len(replacement) == 0:
-            return ParseFailure('empty delimited region', (seq[left_index], token))
-        repl_length = len(replacement)
-
-        seq = seq[:left_index] + replacement + seq[index+1:]
-        index = index - 1 - (inter_length - repl_length) - 1
+            return ParseFailure('empty delimited region', (left_token, token))
 
         stack.pop()
-        index += 1
+        out = enclosing
+        out.extend(replacement)
 
     if len(stack) > 0:
-        left_index, _ = stack[-1]
-        return ParseFailure('unpaired delimiter', seq[left_index])
+        left_token, _, _ = stack[-1]
+        return ParseFailure('unpaired delimiter', left_token)
 
     # Parse the delimiter-free sequence
-    return parse_interior('root', seq)
+    return parse_interior('root', out)
 
 
 #~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~